@@ -2,12 +2,13 @@
 
 """Unit tests for edit-filenames."""
 
+import contextlib
 import errno
+import io
 import itertools
 import os
 import pathlib
 import stat
-import sys
 import typing
 import unittest
 import unittest.mock
@@ -15,11 +16,16 @@ import unittest.mock
 import edit_filenames
 
 
-# Mocked autospec functions are buggy in some versions of Python:
-# <https://stackoverflow.com/q/56367526/>
-if sys.version_info < (3, 7, 5) or (3, 8) < sys.version_info < (3, 8, 2):
-    print("Python 3.8.2 or later is required.", file=sys.stderr)
-    sys.exit(1)
+def _make_stat_result(file_type: int) -> os.stat_result:
+    """Returns a fake `os.stat_result` for a file of the specified type."""
+    result = [0] * 10
+    result[stat.ST_MODE] = file_type | stat.S_IRUSR | stat.S_IWUSR
+    return os.stat_result(tuple(result))
+
+
+# `FakeFileTable.stat` returns only these two shapes, so build them once.
+_file_stat_result = _make_stat_result(stat.S_IFREG)
+_directory_stat_result = _make_stat_result(stat.S_IFDIR)
 
 
 class FakeFileTable:
@@ -28,30 +34,41 @@ class FakeFileTable:
     existence of faked files.
     """
 
+    __slots__ = ("existing_files", "existing_directories", "cwd")
+
     existing_files: typing.Set[str]
     existing_directories: typing.Set[str]
+    cwd: str
 
     def __init__(self) -> None:
         self.existing_files = set()
         self.existing_directories = set()
+        self.cwd = os.getcwd()
+
+    def abspath(self, path: typing.Union[str, os.PathLike]) -> str:
+        """
+        Equivalent to `os.path.abspath` but uses the working directory captured
+        at construction instead of calling `os.getcwd` each time.
+        """
+        return os.path.normpath(os.path.join(self.cwd, path))
 
     def add_files(self, paths: typing.Iterable[str]) -> None:
         """
         Adds files and their parent directories to the fake file system to
         treat them as existing.
         """
-        paths = [os.path.abspath(path) for path in paths]
-        self.existing_files.update(paths)
-        self.add_directories((os.path.dirname(path) for path in paths))
+        absolute_paths = tuple(map(self.abspath, paths))
+        self.existing_files.update(absolute_paths)
+        self.add_directories(map(os.path.dirname, absolute_paths))
 
     def remove_paths(self, paths: typing.Iterable[str]) -> None:
         """
         Removes the specified paths to files or to directories from the fake
         file system so that they are no longer considered to exist.
         """
-        paths = [os.path.abspath(path) for path in paths]
-        self.existing_files.difference_update(paths)
-        self.existing_directories.difference_update(paths)
+        absolute_paths = tuple(map(self.abspath, paths))
+        self.existing_files.difference_update(absolute_paths)
+        self.existing_directories.difference_update(absolute_paths)
 
     def add_directories(self, paths: typing.Iterable[str]) -> None:
         """
@@ -59,10 +76,8 @@ class FakeFileTable:
         as existing.
         """
         for path in paths:
-            while True:
+            while path not in self.existing_directories:
                 assert path not in self.existing_files
-                if path in self.existing_directories:
-                    break
                 self.existing_directories.add(path)
                 path = os.path.dirname(path)
 
@@ -73,7 +88,7 @@ class FakeFileTable:
               dir_fd: typing.Optional[int] = None) -> None:  # pylint: disable=unused-argument
         """Fake version of `os.mkdir`."""
         original_path = path
-        path = os.path.abspath(path)
+        path = self.abspath(path)
         if os.path.dirname(path) not in self.existing_directories:
             raise OSError(errno.ENOENT, "No such file or directory",
                           original_path)
@@ -86,24 +101,44 @@ class FakeFileTable:
              follow_symlinks: bool = True) -> os.stat_result:  # pylint: disable=unused-argument
         """Fake version of `os.stat`."""
         original_path = path
-        path = os.path.abspath(path)
+        path = self.abspath(path)
 
-        parent = os.path.dirname(path)
-        if parent != path and not os.path.isdir(parent):
-            raise OSError(errno.ENOENT, "No such file or directory", path)
+        # Every ancestor must be an existing directory.  Check them with
+        # direct set lookups instead of recursing through the patched
+        # `os.stat` (via `os.path.isdir`) for each level.
+        (child, parent) = (path, os.path.dirname(path))
+        while parent != child:
+            if parent not in self.existing_directories:
+                raise OSError(errno.ENOENT, "No such file or directory", path)
+            (child, parent) = (parent, os.path.dirname(parent))
 
-        result = [0] * 10
         if path in self.existing_files:
-            result[stat.ST_MODE] = stat.S_IFREG
-        elif path in self.existing_directories:
-            result[stat.ST_MODE] = stat.S_IFDIR
-        else:
+            return _file_stat_result
+        if path in self.existing_directories:
+            return _directory_stat_result
+        raise OSError(errno.ENOENT, "No such file or directory", original_path)
+
+    def move(self, source_path: str, destination_path: str) -> None:
+        """Fake version of `shutil.move`."""
+        source_mode = self.stat(source_path).st_mode
+
+        # Check the destination's parent through `stat` so that every ancestor
+        # must exist too, as with `os.path.isdir`.
+        absolute_destination_path = self.abspath(destination_path)
+        try:
+            parent_mode = self.stat(
+                os.path.dirname(absolute_destination_path)).st_mode
+        except OSError:
+            parent_mode = 0
+        if not stat.S_ISDIR(parent_mode):
             raise OSError(errno.ENOENT, "No such file or directory",
-                          original_path)
+                          destination_path)
 
-        result[stat.ST_MODE] |= stat.S_IRUSR | stat.S_IWUSR
-
-        return os.stat_result(tuple(result))
+        if stat.S_ISDIR(source_mode):
+            self.add_directories([absolute_destination_path])
+        else:
+            self.add_files([absolute_destination_path])
+        self.remove_paths([source_path])
 
     def lstat(self,
               path: os.PathLike,
@@ -116,6 +151,8 @@ class FakeFileTable:
 class TestContext:
     """Context for storing test parameters and state."""
 
+    __slots__ = ("original_filename_list", "new_filenames", "fake_file_table")
+
     original_filename_list: typing.List[str]
     new_filenames: str
     fake_file_table: FakeFileTable
@@ -126,41 +163,26 @@ class TestContext:
         self.fake_file_table = FakeFileTable()
 
 
-_original_print = print
-
-
-def fake_print(*args: typing.Any, **kwargs: typing.Any) -> None:
+def call_recorder(name: str,
+                  function: typing.Callable,
+                  calls: typing.List[typing.Any]) -> typing.Callable:
     """
-    Fake version of `print` that swallows output to `sys.stdout` and to
-    `sys.stderr`.
+    Returns a wrapper around `function` that appends a `unittest.mock.call`
+    named `name` to `calls` whenever it is invoked.
     """
-    file = kwargs.get('file')
-    if file is not None and file != sys.stdout and file != sys.stderr:
-        _original_print(*args, **kwargs)
-
-
-def fake_move(test_ctx: TestContext) -> typing.Callable:
-    """Returns a fake version of `shutil.move`."""
-    def helper(source_path: str, destination_path: str) -> None:
-        if not os.path.exists(source_path):
-            raise OSError(errno.ENOENT, "No such file or directory", source_path)
-
-        if not os.path.isdir(os.path.dirname(destination_path)):
-            raise OSError(errno.ENOENT, "No such file or directory", destination_path)
-
-        if os.path.isdir(source_path):
-            test_ctx.fake_file_table.add_directories([destination_path])
-        else:
-            test_ctx.fake_file_table.add_files([destination_path])
-        test_ctx.fake_file_table.remove_paths([source_path])
+    def helper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        calls.append(getattr(unittest.mock.call, name)(*args, **kwargs))
+        return function(*args, **kwargs)
     return helper
 
 
 def fake_edit_temporary(mock_contents: str) -> typing.Callable:
     """Returns a fake version of `spawneditor.edit_file`."""
+    lines = mock_contents.splitlines(keepends=True)
+
     def edit_temporary(*_args: typing.Any,
-                       **_kwargs: typing.Any) -> typing.Iterator[str]:
-        yield from mock_contents.splitlines(keepends=True)
+                       **_kwargs: typing.Any) -> typing.List[str]:
+        return lines
     return edit_temporary
 
 
@@ -169,10 +191,12 @@ def expect_edit_move(test_case: unittest.TestCase,
                      new_filenames: str,
                      expected_calls: typing.List,
                      test_ctx: typing.Optional[TestContext] = None,
-                     raises: typing.Any = None) -> None:
+                     raises: typing.Any = None) -> str:
     """
     Verifies the behavior of `edit_filenames.edit_move`, setting up necessary
     mocks.
+
+    Returns the output that `edit_filenames.edit_move` wrote to stderr.
     """
     test_ctx = test_ctx or TestContext()
     test_ctx.original_filename_list = original_filename_list
@@ -180,22 +204,26 @@ def expect_edit_move(test_case: unittest.TestCase,
 
     test_ctx.fake_file_table.add_files(test_ctx.original_filename_list)
 
-    with unittest.mock.patch("os.stat", test_ctx.fake_file_table.stat), \
+    # The interleaved sequence of `os.mkdir` and `shutil.move` calls.
+    calls: typing.List[typing.Any] = []
+
+    # Capture output from `edit_filenames` by redirecting the standard streams
+    # instead of intercepting every `print` call.
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()), \
+         contextlib.redirect_stderr(stderr), \
+         unittest.mock.patch("os.stat", test_ctx.fake_file_table.stat), \
          unittest.mock.patch("os.lstat", test_ctx.fake_file_table.lstat), \
-         unittest.mock.patch("builtins.print", fake_print), \
          unittest.mock.patch("spawneditor.edit_temporary",
                              fake_edit_temporary(test_ctx.new_filenames)), \
          unittest.mock.patch("os.mkdir",
-                             side_effect=test_ctx.fake_file_table.mkdir,
-                             autospec=True) as mock_mkdir, \
+                             call_recorder("mkdir",
+                                           test_ctx.fake_file_table.mkdir,
+                                           calls)), \
          unittest.mock.patch("shutil.move",
-                             side_effect=fake_move(test_ctx),
-                             autospec=True) as mock_move:
-
-        mock_manager = unittest.mock.Mock()
-        mock_manager.attach_mock(mock_mkdir, "mkdir")
-        mock_manager.attach_mock(mock_move, "move")
-
+                             call_recorder("move",
+                                           test_ctx.fake_file_table.move,
+                                           calls)):
         try:
             edit_filenames.edit_move(test_ctx.original_filename_list,
                                      interactive=False)
@@ -207,7 +235,11 @@ def expect_edit_move(test_case: unittest.TestCase,
             else:
                 raise
 
-        mock_manager.assert_has_calls(expected_calls)
+        # Every test specifies the complete sequence of calls, so compare the
+        # lists directly instead of searching for a subsequence.
+        test_case.assertEqual(calls, expected_calls)
+
+    return stderr.getvalue()
 
 
 class TestEditFilenames(unittest.TestCase):
@@ -297,6 +329,51 @@ class TestEditFilenames(unittest.TestCase):
             [],
             raises=edit_filenames.AbortError)
 
+        # Verify that each duplicate destination is reported only once.
+        errors = expect_edit_move(
+            self,
+            ["a", "b", "c"],
+            "z\nz\nz\n",
+            [],
+            raises=edit_filenames.AbortError)
+        self.assertEqual(errors.count("\"z\" already used as a destination."),
+                         1)
+
+    def test_edit_move_no_paths(self) -> None:
+        """
+        Tests that `edit_filenames.edit_move` fails without spawning the editor
+        if no file paths are specified.
+        """
+        with unittest.mock.patch("spawneditor.edit_temporary") \
+                as mock_edit_temporary:
+            with self.assertRaises(edit_filenames.AbortError):
+                edit_filenames.edit_move([], interactive=False)
+            mock_edit_temporary.assert_not_called()
+
+    def test_edit_move_embedded_null(self) -> None:
+        """
+        Tests that `edit_filenames.edit_move` fails cleanly for a path with an
+        embedded null character.
+        """
+        # Use the real `os.stat`, which raises a `ValueError` for such paths.
+        with unittest.mock.patch("spawneditor.edit_temporary") \
+                as mock_edit_temporary:
+            with self.assertRaises(edit_filenames.AbortError):
+                edit_filenames.edit_move(["foo\0bar"], interactive=False)
+            mock_edit_temporary.assert_not_called()
+
+    def test_sanitized_path(self) -> None:
+        """Tests the behavior of `edit_filenames.sanitized_path`."""
+        self.assertEqual(edit_filenames.sanitized_path("a\rb\nc\x01d\x7f"),
+                         "a b cd\x7f")
+        self.assertEqual(edit_filenames.sanitized_path("é\r\x01\u2028"),
+                         "é \u2028")
+
+        # Verify that ASCII and non-ASCII paths are sanitized identically.
+        for i in range(128):
+            self.assertEqual(edit_filenames.sanitized_path(f"{chr(i)}é"),
+                             f"{edit_filenames.sanitized_path(chr(i))}é")
+
     def test_edit_added_lines(self) -> None:
         """Tests that renames fail if lines were added in the editor."""
         expect_edit_move(
@@ -383,13 +460,51 @@ class TestEditFilenames(unittest.TestCase):
             edited_paths = edit_filenames.edit_paths(input_paths,
                                                      show_instructions=False)
             mock_edit_temporary.assert_called_once()
-            content_lines = list(mock_edit_temporary.call_args.args[0])
+            content_lines = list(itertools.chain.from_iterable(
+                (s.split("\n") for s in mock_edit_temporary.call_args.args[0])
+            ))
             line_number = mock_edit_temporary.call_args.kwargs["line_number"]
 
             self.assertTrue(line_number is None or line_number == 1)
             self.assertEqual(content_lines, input_paths)
             self.assertEqual(edited_paths, ["foo", "bar", "qux"])
 
+    def test_edit_paths_empty(self) -> None:
+        """
+        Tests that `edit_filenames.edit_paths` returns no paths if the edited
+        file is empty or contains only blank lines.
+        """
+        for edited_file in ([], ["\n", "\n"]):
+            with unittest.mock.patch("spawneditor.edit_temporary",
+                                     return_value=edited_file):
+                self.assertEqual(
+                    edit_filenames.edit_paths(["foo"], show_instructions=True),
+                    [])
+
+    def test_edit_paths_edited_instructions(self) -> None:
+        """
+        Tests that `edit_filenames.edit_paths` finds the paths after the last
+        non-trailing blank line even if the user edited the instructions.
+        """
+        edited_file = [
+            "*****\n",
+            "* INSTRUCTIONS:\n",
+            "\n",
+            "* Edited by the user.\n",
+            "*****\n",
+            "\n",
+            "foo\n",
+            "bar\n",
+            "\n",
+            "\n",
+        ]
+        with unittest.mock.patch("spawneditor.edit_temporary",
+                                 return_value=edited_file):
+            self.assertEqual(
+                edit_filenames.edit_paths(["foo", "baz"],
+                                          show_instructions=True),
+                ["foo", "bar"])
+
 
 if __name__ == "__main__":
     unittest.main()